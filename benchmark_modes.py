@@ -0,0 +1,192 @@
+"""
+Benchmark : mode microservices (HTTP + JSON) vs mode monolithe (appels en mémoire).
+
+Lance successivement les deux déploiements (sur des dossiers temporaires, pour ne pas toucher
+aux vrais index), envoie les mêmes PDF et les mêmes questions, puis compare :
+  - la latence de bout en bout de /upload-pdf et /ask-qa ;
+  - la durée des sauts inter-services, lue sur /metrics
+    (anonymizer_request, indexer_request, indexer_retrieve).
+Les étapes de calcul (pdfplumber, spaCy, embeddings, FAISS, LLM) sont identiques dans les deux
+modes : l'écart mesuré correspond au coût HTTP / JSON supprimé.
+
+Usage : python benchmark_modes.py [--rounds 3] [--questions 3] [--skip-qa]
+(--skip-qa si HF_TOKEN n'est pas configuré : /ask-qa répond 503 sans LLM)
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import requests
+
+ROOT = Path(__file__).resolve().parent
+DOCUMENTS = sorted((ROOT / "doc-ingestor" / "documents").glob("*.pdf"))
+
+PORTS = {"doc-ingestor": 8000, "semantic-indexer": 8001, "llm-qa-module": 8002, "deid-service": 8003}
+HOP_STAGES = {
+    "doc-ingestor": "anonymizer_request",
+    "deid-service": "indexer_request",
+    "llm-qa-module": "indexer_retrieve",
+}
+
+QUESTIONS = [
+    "Quels sont les antécédents médicaux du patient ?",
+    "Quel traitement a été prescrit ?",
+    "Résume les résultats des examens sous forme de tableau.",
+]
+
+STAGE_LINE = re.compile(r'docqa_stage_duration_seconds_(count|sum)\{[^}]*stage="([^"]+)"[^}]*\} (\S+)')
+
+
+def start_deployment(mode: str, workdir: Path) -> List[subprocess.Popen]:
+    """Lance les services dans le mode demandé, avec des données isolées dans workdir."""
+    env = dict(
+        os.environ,
+        DOCS_FOLDER=str(workdir / "documents"),
+        VECTOR_FOLDER=str(workdir / "vector_store"),
+        COUNTER_FILE=str(workdir / "patient_counter.txt"),
+        DEBUG_DIR=str(workdir / "debug_anonymized_docs"),
+    )
+    # Le fichier de log reste ouvert dans les processus enfants
+    with open(workdir / f"{mode}.log", "w", encoding="utf-8") as log:
+        if mode == "monolithe":
+            return [subprocess.Popen([sys.executable, "monolith.py"], cwd=ROOT, env=env, stdout=log, stderr=log)]
+
+        return [
+            subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                cwd=ROOT / service, env=env, stdout=log, stderr=log,
+            )
+            for service, port in PORTS.items()
+        ]
+
+
+def wait_ready(timeout: float = 600.0):
+    """Attend que les quatre services répondent sur /metrics (chargement des modèles inclus)."""
+    deadline = time.time() + timeout
+    for port in PORTS.values():
+        while True:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/metrics", timeout=2).ok:
+                    break
+            except requests.exceptions.RequestException:
+                pass
+            if time.time() > deadline:
+                raise TimeoutError(f"Service sur le port {port} injoignable après {timeout:.0f}s")
+            time.sleep(1)
+
+
+def stage_snapshot() -> Dict[Tuple[str, str], List[float]]:
+    """Relève (count, sum) des étapes de saut inter-services sur chaque /metrics."""
+    snapshot = {}
+    for service, stage in HOP_STAGES.items():
+        text = requests.get(f"http://127.0.0.1:{PORTS[service]}/metrics", timeout=5).text
+        values = [0.0, 0.0]
+        for kind, name, value in STAGE_LINE.findall(text):
+            if name == stage:
+                values[0 if kind == "count" else 1] = float(value)
+        snapshot[(service, stage)] = values
+    return snapshot
+
+
+def upload(pdf: Path, conversation_id: str) -> float:
+    start = time.perf_counter()
+    with open(pdf, "rb") as f:
+        response = requests.post(
+            f"http://127.0.0.1:{PORTS['doc-ingestor']}/upload-pdf",
+            files={"file": (pdf.name, f, "application/pdf")},
+            data={"conversation_id": conversation_id},
+        )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def ask(question: str, conversation_id: str) -> float:
+    start = time.perf_counter()
+    response = requests.post(
+        f"http://127.0.0.1:{PORTS['llm-qa-module']}/ask-qa",
+        json={"prompt": question, "conversation_id": conversation_id, "history": []},
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_mode(mode: str, rounds: int, questions: List[str]) -> Dict[str, object]:
+    workdir = Path(tempfile.mkdtemp(prefix=f"docqa-bench-{mode}-"))
+    processes = start_deployment(mode, workdir)
+    try:
+        wait_ready()
+
+        # Échauffement (non mesuré) : premiers appels, caches, index créé
+        upload(DOCUMENTS[0], "bench-warmup")
+        for question in questions[:1]:
+            ask(question, "bench-warmup")
+
+        before = stage_snapshot()
+        uploads, asks = [], []
+        for r in range(rounds):
+            conversation_id = f"bench-{r}"
+            uploads += [upload(pdf, conversation_id) for pdf in DOCUMENTS]
+            asks += [ask(question, conversation_id) for question in questions]
+        after = stage_snapshot()
+
+        hops = {}
+        for key, (count, total) in after.items():
+            calls = count - before[key][0]
+            hops[key[1]] = (total - before[key][1]) / calls if calls else None
+        return {"uploads": uploads, "asks": asks, "hops": hops}
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def describe(samples: List[float]) -> str:
+    if not samples:
+        return "-"
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    return f"moy {statistics.mean(ordered) * 1000:8.1f} ms | p50 {statistics.median(ordered) * 1000:8.1f} ms | p95 {p95 * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3, help="Nombre de passes sur les PDF de doc-ingestor/documents")
+    parser.add_argument("--questions", type=int, default=len(QUESTIONS), help="Questions posées par passe")
+    parser.add_argument("--skip-qa", action="store_true", help="Ne pas appeler /ask-qa (pas de HF_TOKEN)")
+    args = parser.parse_args()
+
+    questions = [] if args.skip_qa else QUESTIONS[:args.questions]
+    results = {}
+    for mode in ("microservices", "monolithe"):
+        print(f"⏳ Benchmark du mode {mode}...")
+        results[mode] = run_mode(mode, args.rounds, questions)
+
+    print()
+    for mode, result in results.items():
+        print(f"=== {mode} ===")
+        print(f"  /upload-pdf  : {describe(result['uploads'])}")
+        print(f"  /ask-qa      : {describe(result['asks'])}")
+        for stage, mean in result["hops"].items():
+            shown = f"{mean * 1000:8.1f} ms" if mean is not None else "-"
+            print(f"  {stage:<20}: moy {shown}")
+
+    micro, mono = results["microservices"], results["monolithe"]
+    print("\n=== Gain du mode monolithe (moyennes) ===")
+    for label, key in [("/upload-pdf", "uploads"), ("/ask-qa", "asks")]:
+        if micro[key] and mono[key]:
+            saved = statistics.mean(micro[key]) - statistics.mean(mono[key])
+            print(f"  {label:<12}: {saved * 1000:+.1f} ms par requête")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Observabilité commune aux microservices : Request-ID propagé d'un service à l'autre,
+chronométrage des étapes du pipeline et export des métriques au format texte Prometheus.
+"""
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+from fastapi import FastAPI, Request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# ID de la requête en cours, propagé aux services appelés
+# (un seul ContextVar par processus : en mode monolithe, les appels en mémoire gardent l'ID d'origine)
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Label "path" des requêtes qui ne correspondent à aucune route (404, scans...)
+UNMATCHED_PATH = "unmatched"
+
+def trace_headers() -> Dict[str, str]:
+    """En-têtes à joindre aux appels sortants pour propager le Request-ID."""
+    return {REQUEST_ID_HEADER: request_id_var.get()}
+
+def escape_label_value(value: str) -> str:
+    """Échappe une valeur de label au format texte Prometheus."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class ServiceMetrics:
+    """Métriques d'un service : (métrique, labels) -> [nombre d'observations, somme des durées en secondes]."""
+
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+        self._metrics: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric: str, labels: Dict[str, str], seconds: float):
+        """Enregistre une durée dans les métriques du service."""
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._metrics.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    @contextmanager
+    def stage_timer(self, stage: str):
+        """Chronomètre une étape du pipeline (log + métrique docqa_stage_duration_seconds)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("docqa_stage_duration_seconds", {"stage": stage}, elapsed)
+            print(f"⏱️ [{request_id_var.get()}] {stage} : {elapsed * 1000:.1f} ms")
+
+    def render(self) -> str:
+        """
+        Export des métriques au format texte Prometheus (summary : _count / _sum).
+        Label pid : avec uvicorn --workers N, chaque worker a ses propres compteurs et répond seul au scrape.
+        """
+        lines = []
+        with self._lock:
+            items = sorted(self._metrics.items())
+        declared = set()
+        for (metric, labels), (count, total) in items:
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} summary")
+                declared.add(metric)
+            label_str = ",".join([f'service="{self.service_name}"', f'pid="{os.getpid()}"'] + [f'{k}="{escape_label_value(v)}"' for k, v in labels])
+            lines.append(f"{metric}_count{{{label_str}}} {int(count)}")
+            lines.append(f"{metric}_sum{{{label_str}}} {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+def install_tracing(app: FastAPI, metrics: ServiceMetrics):
+    """Ajoute à l'application le middleware Request-ID + durée de chaque requête HTTP."""
+
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        """Attribue (ou reprend) un Request-ID et mesure la durée de chaque requête HTTP."""
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            response.headers[REQUEST_ID_HEADER] = request_id
+            return response
+        finally:
+            # Gabarit de la route (ex: /upload-pdf) plutôt que l'URL brute : nombre de séries borné
+            route = request.scope.get("route")
+            path = route.path if route is not None else UNMATCHED_PATH
+            metrics.observe(
+                "docqa_http_request_duration_seconds",
+                {"method": request.method, "path": path, "status": str(status_code)},
+                time.perf_counter() - start,
+            )
+            request_id_var.reset(token)
@@ -1,21 +1,34 @@
 import os
+import sys
 import uvicorn
 import spacy
 import re  # Pour les Expressions Régulières
 import requests
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Callable
+
+# Module partagé entre les services (dossier common/ à la racine du dépôt), placé en tête du chemin
+# pour primer sur un éventuel paquet installé nommé "common"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.observability import ServiceMetrics, install_tracing, trace_headers
 
 # --- Configuration ---
 
 INDEXER_URL = os.getenv("INDEXER_URL", "http://127.0.0.1:8001") 
 
+# Mode monolithe (voir monolith.py) : appel direct de l'indexeur, sans HTTP ni JSON
+index_in_process: Optional[Callable[[dict], dict]] = None
+lookup_in_process: Optional[Callable[[dict], dict]] = None
+
 # Modèle NLP
 MODEL_NAME = "fr_core_news_md" 
 nlp = None
-COUNTER_FILE = "patient_counter.txt" 
-DEBUG_DIR = "debug_anonymized_docs"
+COUNTER_FILE = os.getenv("COUNTER_FILE", "patient_counter.txt")
+DEBUG_DIR = os.getenv("DEBUG_DIR", "debug_anonymized_docs")
+# Écriture des textes anonymisés sur disque : désactivée par défaut (opt-in)
+DEBUG_DUMP = os.getenv("DEID_DEBUG_DUMP", "0") == "1"
 
 def load_nlp_model():
     """Charge le modèle SpaCy au démarrage."""
@@ -27,7 +40,7 @@ def load_nlp_model():
     except OSError:
         raise EnvironmentError(f"❌ Modèle manquant. Exécutez : python -m spacy download {MODEL_NAME}")
 
-    if not os.path.exists(DEBUG_DIR):
+    if DEBUG_DUMP and not os.path.exists(DEBUG_DIR):
         os.makedirs(DEBUG_DIR)
         print(f"📂 Dossier de debug créé : {DEBUG_DIR}")
 
@@ -55,12 +68,48 @@ def get_next_patient_id():
         
     return patient_label
 
+def call_indexer(endpoint: str, in_process: Optional[Callable[[dict], dict]], data: dict) -> dict:
+    """Appelle un endpoint de l'indexeur : en mémoire (mode monolithe) ou via HTTP."""
+    if in_process is not None:
+        try:
+            return in_process(data)
+        except HTTPException as e:
+            # Même traitement qu'une erreur HTTP de l'indexeur
+            raise requests.exceptions.RequestException(e.detail)
+        except Exception as e:
+            # Requête invalide (ValidationError) ou erreur inattendue : même 503 qu'en mode HTTP
+            raise requests.exceptions.RequestException(str(e))
+
+    response = requests.post(f"{INDEXER_URL}{endpoint}", json=data, headers=trace_headers())
+    response.raise_for_status()
+    return response.json()
+
+def send_to_indexer(data: dict) -> dict:
+    """Envoie le texte anonymisé à l'indexeur."""
+    return call_indexer("/index-chunks", index_in_process, data)
+
+def lookup_indexed_document(data: dict) -> dict:
+    """Demande à l'indexeur si ce document (même empreinte) est déjà indexé dans la conversation."""
+    return call_indexer("/document-status", lookup_in_process, data)
+
+def already_indexed_response(source: str, patient_id: Optional[str]) -> dict:
+    """Réponse quand le document est déjà indexé : aucun nouvel ID n'est attribué."""
+    return {
+        "status": "success",
+        "message": f"Document déjà indexé avec {patient_id}.",
+        "original_filename": source,
+        "assigned_id": patient_id,
+        "anonymized_preview": "",
+        "already_indexed": True
+    }
+
 # --- Schémas de Données ---
 
 class DeIDRequest(BaseModel):
     content: str
     source: str
     conversation_id: str
+    content_hash: Optional[str] = None
 
 class DeIDResponse(BaseModel):
     anonymized_content: str
@@ -73,27 +122,29 @@ def advanced_anonymization(text: str, patient_label: str) -> str:
     Remplace les noms par l'ID du patient (ex: Patient_1) pour que le tableau final soit clair.
     """
     
-    # 1. Masquer les EMAILS
-    text = re.sub(r'[\w\.-]+@[\w\.-]+\.\w+', '[EMAIL_MASQUÉ]', text)
-    
-    # 2. Masquer les TÉLÉPHONES
-    phone_pattern = r'(?:(?:\+|00)33|0)\s*[1-9](?:[\s.-]*\d{2}){4}'
-    text = re.sub(phone_pattern, '[TÉL_MASQUÉ]', text)
-
-    # 3. Masquer les Champs de Formulaire (Nom : X, Prénom : Y)
-    # ICI C'EST LA MAGIE : On remplace par le label (Patient_1) !
-    field_pattern = r'(Nom|Prénom|Patient|Surnom)\s*[:\.]?\s+([A-ZÀ-ÿ][a-zÀ-ÿ]+|[A-Z]{2,})'
-    # La regex va écrire : "Nom : Patient_1"
-    text = re.sub(field_pattern, f"\\1 : {patient_label}", text, flags=re.IGNORECASE)
-
-    # 4. Masquer les NOMS après civilités (Dr., M., Mme)
-    # On fait attention : Si c'est un Dr, on met [MEDECIN] pour ne pas confondre avec le patient
-    # Si c'est Monsieur/Madame, on met le patient_label
-    text = re.sub(r'(Dr\.?)\s+([A-ZÀ-ÿ][a-zÀ-ÿ]+)', r'\1 [MEDECIN]', text)
-    text = re.sub(r'(Monsieur|Madame|M\.|Mme)\s+([A-ZÀ-ÿ][a-zÀ-ÿ]+)', f"\\1 {patient_label}", text)
+    with stage_timer("anonymization_regex"):
+        # 1. Masquer les EMAILS
+        text = re.sub(r'[\w\.-]+@[\w\.-]+\.\w+', '[EMAIL_MASQUÉ]', text)
+
+        # 2. Masquer les TÉLÉPHONES
+        phone_pattern = r'(?:(?:\+|00)33|0)\s*[1-9](?:[\s.-]*\d{2}){4}'
+        text = re.sub(phone_pattern, '[TÉL_MASQUÉ]', text)
+
+        # 3. Masquer les Champs de Formulaire (Nom : X, Prénom : Y)
+        # ICI C'EST LA MAGIE : On remplace par le label (Patient_1) !
+        field_pattern = r'(Nom|Prénom|Patient|Surnom)\s*[:\.]?\s+([A-ZÀ-ÿ][a-zÀ-ÿ]+|[A-Z]{2,})'
+        # La regex va écrire : "Nom : Patient_1"
+        text = re.sub(field_pattern, f"\\1 : {patient_label}", text, flags=re.IGNORECASE)
+
+        # 4. Masquer les NOMS après civilités (Dr., M., Mme)
+        # On fait attention : Si c'est un Dr, on met [MEDECIN] pour ne pas confondre avec le patient
+        # Si c'est Monsieur/Madame, on met le patient_label
+        text = re.sub(r'(Dr\.?)\s+([A-ZÀ-ÿ][a-zÀ-ÿ]+)', r'\1 [MEDECIN]', text)
+        text = re.sub(r'(Monsieur|Madame|M\.|Mme)\s+([A-ZÀ-ÿ][a-zÀ-ÿ]+)', f"\\1 {patient_label}", text)
 
     # 5. NLP (SpaCy) - Filet de sécurité
-    doc = nlp(text)
+    with stage_timer("anonymization_spacy"):
+        doc = nlp(text)
     entities_to_replace = []
     
     for ent in doc.ents:
@@ -111,57 +162,92 @@ def advanced_anonymization(text: str, patient_label: str) -> str:
         
     return text
 
+# --- Observabilité (Request-ID & Métriques, voir common/observability.py) ---
+
+service_metrics = ServiceMetrics("deid-service")
+stage_timer = service_metrics.stage_timer
+
 # --- FastAPI App ---
 
 app = FastAPI(title="De-ID Microservice (Injection ID Patient)")
 
+install_tracing(app, service_metrics)
+
 @app.on_event("startup")
 async def startup_event():
     load_nlp_model()
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return service_metrics.render()
+
 @app.post("/anonymize-text", status_code=200)
 def anonymize_and_index(request: DeIDRequest):
     if nlp is None:
         raise HTTPException(status_code=503, detail="Le modèle NLP n'est pas prêt.")
 
+    # 0. Document déjà indexé (même empreinte) : pas de ré-anonymisation ni de nouvel ID
+    if request.content_hash:
+        try:
+            with stage_timer("indexer_lookup"):
+                status = lookup_indexed_document({
+                    "conversation_id": request.conversation_id,
+                    "source": request.source,
+                    "content_hash": request.content_hash
+                })
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Erreur connexion Indexeur (8001): {e}")
+            raise HTTPException(status_code=503, detail=f"Indexeur injoignable: {e}")
+
+        if status["already_indexed"]:
+            print(f"♻️ Document déjà indexé : {request.source} ({status['source']}, {status['patient_id']})")
+            return already_indexed_response(request.source, status["patient_id"])
+
     unique_patient_id = get_next_patient_id()
     print(f"🆔 Nouveau document : {request.source} -> ID attribué : {unique_patient_id}")
 
     # 1. Exécution de l'anonymisation EN PASSANT L'ID
     try:
         # ON PASSE L'ID ICI !
-        clean_text = advanced_anonymization(request.content, unique_patient_id)
+        with stage_timer("advanced_anonymization"):
+            clean_text = advanced_anonymization(request.content, unique_patient_id)
         
-        # SAUVEGARDE DEBUG
-        filename = f"{unique_patient_id}.txt"
-        filepath = os.path.join(DEBUG_DIR, filename)
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(f"--- SOURCE ORIGINALE : {request.source} ---\n\n")
-            f.write(clean_text)
-        print(f"💾 Fichier transformé sauvegardé : {filepath}")
+        # SAUVEGARDE DEBUG (opt-in via DEID_DEBUG_DUMP=1)
+        if DEBUG_DUMP:
+            filename = f"{unique_patient_id}.txt"
+            filepath = os.path.join(DEBUG_DIR, filename)
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(f"--- SOURCE ORIGINALE : {request.source} ---\n\n")
+                f.write(clean_text)
+            print(f"💾 Fichier transformé sauvegardé : {filepath}")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur interne d'anonymisation : {e}")
 
     # 2. Envoi à l'Indexeur (Port 8001)
-    ingest_endpoint = f"{INDEXER_URL}/index-chunks"
-    
     data = {
         "content": clean_text,
         "source": request.source, # On garde le nom du fichier pour l'affichage des sources
-        "conversation_id": request.conversation_id
+        "conversation_id": request.conversation_id,
+        "content_hash": request.content_hash, # Empreinte du document d'origine (le texte anonymisé change à chaque upload)
+        "patient_id": unique_patient_id
     }
 
     try:
-        response = requests.post(ingest_endpoint, json=data)
-        response.raise_for_status() 
-        
+        with stage_timer("indexer_request"):
+            index_response = send_to_indexer(data)
+
+        # Indexé entre-temps par un upload concurrent : cet ID n'a pas été utilisé
+        if index_response.get("already_indexed"):
+            return already_indexed_response(request.source, index_response.get("patient_id"))
+
         return {
             "status": "success",
             "message": f"Texte anonymisé avec {unique_patient_id}.",
             "original_filename": request.source,
             "assigned_id": unique_patient_id,
-            "anonymized_preview": clean_text[:200]
+            "anonymized_preview": clean_text[:200],
+            "already_indexed": False
         }
     except requests.exceptions.RequestException as e:
         print(f"❌ Erreur connexion Indexeur (8001): {e}")
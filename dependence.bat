@@ -11,7 +11,7 @@ python -m pip install --upgrade pip
 echo.
 echo [2/3] Installation des librairies Python (Nettoyees)...
 :: J'ai ajoute chromadb si tu utilises le code que je t'ai donne pour le multi-tenant
-pip install fastapi uvicorn pydantic requests python-multipart pdfplumber langchain langchain-huggingface langchain-community python-dotenv faiss-cpu chromadb sentence-transformers spacy huggingface-hub
+pip install fastapi uvicorn pydantic requests python-multipart pdfplumber langchain langchain-huggingface langchain-community python-dotenv faiss-cpu chromadb sentence-transformers spacy huggingface-hub filelock
 
 echo.
 echo [3/4] Telechargement du modele de langue Spacy (Francais)...
@@ -1,11 +1,21 @@
 import os
+import sys
+import hashlib
 import uvicorn
 import requests
 from pathlib import Path
+from typing import Callable, Optional
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import pdfplumber
 
+# Module partagé entre les services (dossier common/ à la racine du dépôt), placé en tête du chemin
+# pour primer sur un éventuel paquet installé nommé "common"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.observability import REQUEST_ID_HEADER, ServiceMetrics, install_tracing, trace_headers
+
 # --- Configuration ---
 
 DOCS_FOLDER = os.getenv("DOCS_FOLDER", "documents")
@@ -16,6 +26,14 @@ os.makedirs(DOCS_FOLDER, exist_ok=True)
 # Maintenant : On vise l'ANONYMISEUR (8003).
 ANONYMIZER_SERVICE_URL = os.getenv("ANONYMIZER_URL", "http://127.0.0.1:8003") 
 
+# Mode monolithe (voir monolith.py) : appel direct de l'anonymiseur, sans HTTP ni JSON
+anonymize_in_process: Optional[Callable[[dict], dict]] = None
+
+# --- Observabilité (Request-ID & Métriques, voir common/observability.py) ---
+
+service_metrics = ServiceMetrics("doc-ingestor")
+stage_timer = service_metrics.stage_timer
+
 app = FastAPI(title="Document Ingestor Microservice")
 
 app.add_middleware(
@@ -24,8 +42,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[REQUEST_ID_HEADER],
 )
 
+install_tracing(app, service_metrics)
+
 # --- Fonctions ---
 
 def pdf_to_text(path: Path) -> str:
@@ -39,8 +60,29 @@ def pdf_to_text(path: Path) -> str:
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur de lecture PDF: {e}")
 
+async def call_anonymizer(data: dict) -> dict:
+    """Envoie le texte brut à l'anonymiseur : en mémoire (mode monolithe) ou via HTTP."""
+    if anonymize_in_process is not None:
+        try:
+            return await run_in_threadpool(anonymize_in_process, data)
+        except HTTPException as e:
+            # Même traitement qu'une erreur HTTP de l'anonymiseur
+            raise requests.exceptions.RequestException(e.detail)
+        except Exception as e:
+            # Requête invalide (ValidationError) ou erreur inattendue : même 503 qu'en mode HTTP
+            raise requests.exceptions.RequestException(str(e))
+
+    target_endpoint = f"{ANONYMIZER_SERVICE_URL}/anonymize-text"
+    response = requests.post(target_endpoint, json=data, headers=trace_headers())
+    response.raise_for_status()
+    return response.json()
+
 # --- Endpoints ---
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return service_metrics.render()
+
 @app.post("/upload-pdf")
 async def upload_pdf(
     file: UploadFile = File(...), 
@@ -63,30 +105,31 @@ async def upload_pdf(
         await file.close()
 
     # 2. Conversion PDF -> Texte Brut
-    raw_text = pdf_to_text(file_path)
+    with stage_timer("pdf_to_text"):
+        raw_text = await run_in_threadpool(pdf_to_text, file_path)
     if not raw_text.strip():
         raise HTTPException(status_code=400, detail="Le fichier PDF est vide ou illisible.")
 
     # 3. --- CORRECTION MAJEURE ---
     # On envoie vers le service d'Anonymisation (Port 8003)
-    target_endpoint = f"{ANONYMIZER_SERVICE_URL}/anonymize-text"
-    
     data = {
         "content": raw_text,
         "source": file.filename,
-        "conversation_id": conversation_id
+        "conversation_id": conversation_id,
+        # Empreinte du PDF : l'indexeur ignore un ré-upload identique et remplace une version modifiée
+        "content_hash": hashlib.sha256(content).hexdigest()
     }
 
     try:
         # Appel à l'Anonymiseur
-        response = requests.post(target_endpoint, json=data)
-        response.raise_for_status()
+        with stage_timer("anonymizer_request"):
+            anonymizer_response = await call_anonymizer(data)
         
         return {
             "status": "success",
             "filename": file.filename,
             "pipeline_info": "Envoyé à l'anonymiseur (8003)",
-            "anonymizer_response": response.json()
+            "anonymizer_response": anonymizer_response
         }
 
     except requests.exceptions.RequestException as e:
@@ -1,13 +1,21 @@
 
 import os
+import sys
+import random
 import uvicorn
 import requests
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from dotenv import load_dotenv
 
+# Module partagé entre les services (dossier common/ à la racine du dépôt), placé en tête du chemin
+# pour primer sur un éventuel paquet installé nommé "common"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.observability import REQUEST_ID_HEADER, ServiceMetrics, install_tracing, request_id_var, trace_headers
+
 load_dotenv()
 
 # LangChain Imports
@@ -18,6 +26,12 @@ from langchain_core.messages import SystemMessage
 
 INDEXER_URL = os.getenv("INDEXER_URL", "http://127.0.0.1:8001") 
 
+# Mode monolithe (voir monolith.py) : appel direct de l'indexeur, sans HTTP ni JSON
+retrieve_in_process: Optional[Callable[[dict], Any]] = None
+
+# Proportion des requêtes dont le contexte RAG est affiché en console (0 = jamais, 1 = toujours)
+CONTEXT_LOG_SAMPLE_RATE = float(os.getenv("QA_CONTEXT_LOG_SAMPLE_RATE", "0"))
+
 chat_model: Optional[ChatHuggingFace] = None
 
 def load_llm():
@@ -63,6 +77,18 @@ class RetrievalResponse(BaseModel):
     chunks: List[Chunk]
 
 
+def retrieve_chunks(payload: dict) -> List[Chunk]:
+    """Interroge l'indexeur : en mémoire (mode monolithe) ou via HTTP."""
+    if retrieve_in_process is not None:
+        # L'indexeur renvoie ses propres objets Pydantic : on les relit par attributs
+        result = retrieve_in_process(payload)
+        return RetrievalResponse.model_validate(result, from_attributes=True).chunks
+
+    response = requests.post(f"{INDEXER_URL}/retrieve-chunks", json=payload, headers=trace_headers())
+    response.raise_for_status()
+    return RetrievalResponse.model_validate(response.json()).chunks
+
+
 def build_rag_messages(prompt: str, context: str, history: List[Dict[str, str]]):
     """
     Prompt 'ARCHITECTE' : Force le Markdown, interdit le bavardage et gère le multi-patient.
@@ -103,6 +129,13 @@ def build_rag_messages(prompt: str, context: str, history: List[Dict[str, str]])
     messages.append({"role": "user", "content": user_prompt})
 
     return messages
+
+
+# --- Observabilité (Request-ID & Métriques, voir common/observability.py) ---
+
+service_metrics = ServiceMetrics("llm-qa-module")
+stage_timer = service_metrics.stage_timer
+
 # --- FastAPI App ---
 
 app = FastAPI(title="LLM QA Microservice")
@@ -113,33 +146,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[REQUEST_ID_HEADER],
 )
 
+install_tracing(app, service_metrics)
+
 @app.on_event("startup")
 async def startup_event():
     load_llm()
 
 # --- Endpoints ---
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return service_metrics.render()
+
 @app.post("/ask-qa", response_model=QAResponse)
 def ask_qa(input_data: QAInput):
     if chat_model is None:
         raise HTTPException(status_code=503, detail="Le modèle LLM n'est pas chargé.")
 
     # 1. RAG : Récupération des documents
-    retrieval_endpoint = f"{INDEXER_URL}/retrieve-chunks"
     try:
-        response = requests.post(
-            retrieval_endpoint, 
-            json={
+        with stage_timer("indexer_retrieve"):
+            relevant_chunks = retrieve_chunks({
                 "question": input_data.prompt, 
                 "conversation_id": input_data.conversation_id,
                 "k": 6, 
                 "score_threshold": 0.75
-            }
-        )
-        response.raise_for_status()
-        relevant_chunks = RetrievalResponse.model_validate(response.json()).chunks
+            })
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Erreur Indexeur: {e}")
 
@@ -154,18 +189,20 @@ def ask_qa(input_data: QAInput):
     # 3. Génération de la réponse
     context = "\n\n".join([f"[Source: {chunk.source}]\n{chunk.content}" for chunk in relevant_chunks])
 
-    # DEBUG : Affichage console pour vérifier ce que l'IA lit
-    print("==================================================")
-    print("🔍 CE QUE L'IA REÇOIT (CONTEXTE) :")
-    print(context)
-    print("==================================================")
+    # DEBUG : Affichage console (échantillonné) pour vérifier ce que l'IA lit
+    if random.random() < CONTEXT_LOG_SAMPLE_RATE:
+        print("==================================================")
+        print(f"🔍 CE QUE L'IA REÇOIT (CONTEXTE) [{request_id_var.get()}] :")
+        print(context)
+        print("==================================================")
     
     sources = list(set([chunk.source for chunk in relevant_chunks]))
     
     messages = build_rag_messages(input_data.prompt, context, input_data.history)
     
     try:
-        answer = chat_model.invoke(messages).content.strip()
+        with stage_timer("llm_invoke"):
+            answer = chat_model.invoke(messages).content.strip()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur LLM: {e}")
     
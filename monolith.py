@@ -0,0 +1,84 @@
+"""
+Mode monolithe : les quatre microservices FastAPI dans un seul processus.
+
+Les ports et les routes restent identiques (le frontend ne change pas), mais les appels
+Ingestor -> DeID -> Indexeur et QA -> Indexeur deviennent des appels Python directs :
+le texte des documents n'est plus sérialisé en JSON ni renvoyé par HTTP.
+
+Usage : python monolith.py
+"""
+import os
+import sys
+import asyncio
+import importlib.util
+from types import ModuleType
+
+import uvicorn
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+HOST = os.getenv("MONOLITH_HOST", "127.0.0.1")
+INGESTOR_PORT = int(os.getenv("INGESTOR_PORT", "8000"))
+INDEXER_PORT = int(os.getenv("INDEXER_PORT", "8001"))
+LLM_QA_PORT = int(os.getenv("LLM_QA_PORT", "8002"))
+DEID_PORT = int(os.getenv("DEID_PORT", "8003"))
+
+# Les services utilisent des chemins relatifs à leur dossier (lancés via "cd <service>")
+os.environ.setdefault("DOCS_FOLDER", os.path.join(ROOT, "doc-ingestor", "documents"))
+os.environ.setdefault("VECTOR_FOLDER", os.path.join(ROOT, "semantic-indexer", "vector_store"))
+os.environ.setdefault("COUNTER_FILE", os.path.join(ROOT, "deid-service", "patient_counter.txt"))
+os.environ.setdefault("DEBUG_DIR", os.path.join(ROOT, "deid-service", "debug_anonymized_docs"))
+
+
+def load_service(module_name: str, folder: str) -> ModuleType:
+    """Importe le main.py d'un service sous un nom unique (ils s'appellent tous 'main')."""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, folder, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+ingestor = load_service("doc_ingestor_main", "doc-ingestor")
+deid = load_service("deid_service_main", "deid-service")
+indexer = load_service("semantic_indexer_main", "semantic-indexer")
+qa = load_service("llm_qa_module_main", "llm-qa-module")
+
+
+def wire_in_process_calls():
+    """Remplace les appels HTTP inter-services par des appels directs aux endpoints."""
+    # Le Request-ID (common/observability.py) est partagé par tout le processus :
+    # les étapes appelées en mémoire sont journalisées avec l'ID de la requête d'origine
+    ingestor.anonymize_in_process = lambda data: deid.anonymize_and_index(deid.DeIDRequest(**data))
+    deid.index_in_process = lambda data: indexer.index_document(indexer.IngestRequest(**data))
+    deid.lookup_in_process = lambda data: indexer.document_status(indexer.DocumentStatusRequest(**data))
+    qa.retrieve_in_process = lambda payload: indexer.retrieve_chunks(indexer.RetrievalRequest(**payload))
+
+
+async def serve_all():
+    """Sert les quatre applications sur leurs ports habituels, dans la même boucle asyncio."""
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=HOST, port=port))
+        for app, port in [
+            (ingestor.app, INGESTOR_PORT),
+            (indexer.app, INDEXER_PORT),
+            (qa.app, LLM_QA_PORT),
+            (deid.app, DEID_PORT),
+        ]
+    ]
+    tasks = [asyncio.create_task(server.serve()) for server in servers]
+
+    # Si un serveur s'arrête (Ctrl+C, erreur de port...), on arrête les autres
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for server in servers:
+        server.should_exit = True
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    wire_in_process_calls()
+    print("🧩 Mode monolithe : Ingestor, DeID, Indexeur et LLM-QA dans un seul processus.")
+    try:
+        asyncio.run(serve_all())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,23 @@
+@echo off
+color 0A
+echo ========================================================
+echo      LANCEMENT EN MODE MONOLITHE (UN SEUL PROCESSUS)
+echo ========================================================
+echo.
+
+:: 1. Les 4 services Python dans un seul processus (Ports 8000-8003)
+echo [1/2] Lancement des services (monolithe)...
+start "1. DocQA Monolithe (Ports 8000-8003)" cmd /k "python monolith.py"
+
+:: 2. Interface Utilisateur (Next.js - Port 3000)
+echo [2/2] Lancement Interface Frontend (Next.js)...
+timeout /t 2 >nul
+start "2. Frontend NextJS (Port 3000)" cmd /k "cd interface-nextjs && npm run dev"
+
+echo.
+echo ========================================================
+echo      TOUT EST LANCE ! 
+echo      Accedez a votre site sur : http://localhost:3000
+echo ========================================================
+echo.
+pause
\ No newline at end of file
@@ -1,14 +1,33 @@
 import os
+import re
+import sys
+import hashlib
+import uuid
+import time
 import uvicorn
+from contextlib import contextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
+from filelock import FileLock, Timeout
+import faiss
+
+# Module partagé entre les services (dossier common/ à la racine du dépôt), placé en tête du chemin
+# pour primer sur un éventuel paquet installé nommé "common"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.observability import ServiceMetrics, install_tracing
 
 # LangChain Imports
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+# --- Observabilité (Request-ID & Métriques, voir common/observability.py) ---
+
+service_metrics = ServiceMetrics("semantic-indexer")
+stage_timer = service_metrics.stage_timer
 
 # --- Configuration et Modèles ---
 
@@ -22,38 +41,301 @@ embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-
 # Dictionnaire de bases de données vectorielles par conversation_id (chargées en mémoire)
 vectorstores: Dict[str, FAISS] = {}
 
+# Version de l'index chargée en mémoire par conversation_id (comparée au fichier VERSION sur disque)
+loaded_versions: Dict[str, int] = {}
+
+# --- Multi-workers (uvicorn --workers N) ---
+# Chaque écriture publie une nouvelle version de l'index (faiss.index.v<N>.faiss/.pkl) puis met à jour
+# le fichier VERSION. Les workers relisent ce fichier à chaque accès et ne rechargent que la conversation modifiée.
+VERSION_FILE = "VERSION"
+WRITE_LOCK_FILE = "write.lock"
+WRITE_LOCK_TIMEOUT = float(os.getenv("INDEXER_WRITE_LOCK_TIMEOUT", "300"))
+VERSIONED_INDEX = re.compile(r"^faiss\.index\.v(\d+)\.(faiss|pkl)$")
+
+# Sous Windows, remplacer VERSION échoue (PermissionError) tant qu'un autre worker l'a ouvert en lecture,
+# et l'ouvrir peut échouer pendant son remplacement : on réessaie brièvement (attente croissante)
+VERSION_FILE_RETRIES = 5
+VERSION_FILE_RETRY_DELAY = 0.05
+
+# Pseudonyme injecté par le deid-service (Patient_1, Patient_2...) : nouveau à chaque upload, il permet
+# de séparer les copies successives d'un même document dans les anciens index
+PATIENT_LABEL = re.compile(r"Patient_\d+")
+
+# Carte source -> {"content_hash", "patient_id", "ids"} par conversation_id : IDs docstore des vecteurs de chaque document
+# (reconstruite depuis les métadonnées du docstore à chaque chargement, donc toujours cohérente avec l'index)
+source_maps: Dict[str, Dict[str, Dict]] = {}
+
 def get_vector_store_path(conversation_id: str) -> str:
     """Retourne le chemin du dossier pour une conversation spécifique."""
     conv_folder = os.path.join(VECTOR_FOLDER, conversation_id)
     os.makedirs(conv_folder, exist_ok=True)
     return conv_folder
 
+def index_name(version: int) -> str:
+    """Nom des fichiers FAISS d'une version (0 = index historique, sans fichier VERSION)."""
+    return "faiss.index" if version == 0 else f"faiss.index.v{version}"
+
+def retry_on_permission_error(operation):
+    """Exécute operation(), en la réessayant si le fichier VERSION est momentanément verrouillé (Windows)."""
+    for attempt in range(VERSION_FILE_RETRIES):
+        try:
+            return operation()
+        except PermissionError:
+            if attempt == VERSION_FILE_RETRIES - 1:
+                raise
+            time.sleep(VERSION_FILE_RETRY_DELAY * (attempt + 1))
+
+def read_index_version(conversation_id: str) -> int:
+    """Lit la dernière version publiée de l'index d'une conversation (vérification peu coûteuse)."""
+    version_path = os.path.join(get_vector_store_path(conversation_id), VERSION_FILE)
+
+    def read():
+        with open(version_path, "r") as f:
+            return int(f.read().strip())
+
+    try:
+        return retry_on_permission_error(read)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def load_index_files(conversation_id: str, version: int) -> Optional[FAISS]:
+    """Charge une version de l'index depuis le disque, ou None si ses fichiers sont absents ou illisibles."""
+    conv_folder = get_vector_store_path(conversation_id)
+    if not os.path.exists(os.path.join(conv_folder, index_name(version) + ".faiss")):
+        return None
+    try:
+        with stage_timer("load_local"):
+            return FAISS.load_local(
+                conv_folder, 
+                embeddings, 
+                index_name(version),
+                allow_dangerous_deserialization=True
+            )
+    except Exception as e:
+        print(f"⚠️ Erreur de chargement de l'index v{version} pour {conversation_id} : {e}")
+        return None
+
 def load_vector_store(conversation_id: str) -> Optional[FAISS]:
-    """Charge ou initialise l'index FAISS pour une conversation spécifique."""
+    """
+    Charge l'index FAISS d'une conversation (lecture), ou le recharge si un autre worker en a publié une version
+    plus récente. Les écritures passent par load_for_write.
+    """
+    version = read_index_version(conversation_id)
+    if conversation_id in vectorstores and loaded_versions.get(conversation_id, 0) >= version:
+        return vectorstores[conversation_id]
+
+    vectorstore = load_index_files(conversation_id, version)
+    if vectorstore is None:
+        # Deux écritures plus récentes ont pu publier puis supprimer (remove_old_versions) la version lue :
+        # on relit VERSION et on réessaie une fois
+        latest_version = read_index_version(conversation_id)
+        if latest_version != version:
+            version = latest_version
+            vectorstore = load_index_files(conversation_id, version)
+
+    if vectorstore is not None:
+        vectorstores[conversation_id] = vectorstore
+        loaded_versions[conversation_id] = version
+        source_maps[conversation_id] = build_source_map(vectorstore)
+        print(f"✅ Index FAISS chargé pour conversation {conversation_id} (v{version}) ! ({vectorstore.index.ntotal} documents)")
+        return vectorstore
+
     if conversation_id in vectorstores:
+        # En lecture, une version précédente déjà en mémoire reste utilisable
+        print(f"⚠️ Version v{version} indisponible pour {conversation_id} : la version en mémoire reste utilisée.")
         return vectorstores[conversation_id]
-    
+    if version > 0:
+        # Un index a été publié : ne pas répondre comme si la conversation était vide
+        raise HTTPException(status_code=503, detail=f"Index de la conversation {conversation_id} momentanément indisponible.")
+
+    print(f"ℹ️ Aucun index FAISS trouvé pour conversation {conversation_id}. Il sera créé lors de la première ingestion.")
+    return None
+
+def clone_vector_store(vectorstore: FAISS) -> FAISS:
+    """Copie indépendante d'un index en mémoire : vecteurs, docstore et correspondance position -> ID."""
+    return FAISS(
+        embedding_function=vectorstore.embedding_function,
+        index=faiss.clone_index(vectorstore.index),
+        docstore=InMemoryDocstore({
+            doc_id: vectorstore.docstore.search(doc_id)
+            for doc_id in vectorstore.index_to_docstore_id.values()
+        }),
+        index_to_docstore_id=dict(vectorstore.index_to_docstore_id),
+        distance_strategy=vectorstore.distance_strategy,
+    )
+
+def load_for_write(conversation_id: str) -> Tuple[Optional[FAISS], Dict[str, Dict]]:
+    """
+    Copie privée de la dernière version publiée de l'index, à modifier sous conversation_writer.
+    Jamais l'objet en cache lui-même (il peut être parcouru au même moment par /retrieve-chunks),
+    ni une version plus ancienne (elle effacerait les écritures des autres workers).
+    """
+    version = read_index_version(conversation_id)
+
+    # Cache à jour : copie en mémoire, sans relire le disque. loaded_versions est lu avant vectorstores
+    # (load_vector_store les renseigne dans l'ordre inverse) pour ne jamais cloner une version antérieure.
+    if loaded_versions.get(conversation_id) == version:
+        cached = vectorstores.get(conversation_id)
+        if cached is not None:
+            with stage_timer("clone_index"):
+                vectorstore = clone_vector_store(cached)
+            return vectorstore, build_source_map(vectorstore)
+
     conv_folder = get_vector_store_path(conversation_id)
-    index_path = os.path.join(conv_folder, "faiss.index")
-    
-    # On vérifie si le fichier .faiss existe réellement
-    if os.path.exists(index_path + ".faiss"):
-        try:
+
+    if not os.path.exists(os.path.join(conv_folder, index_name(version) + ".faiss")):
+        if version > 0:
+            raise HTTPException(status_code=500, detail=f"Version v{version} de l'index introuvable pour la conversation {conversation_id}.")
+        return None, {}
+
+    try:
+        with stage_timer("load_local"):
             vectorstore = FAISS.load_local(
-                conv_folder, 
-                embeddings, 
-                "faiss.index",
+                conv_folder,
+                embeddings,
+                index_name(version),
                 allow_dangerous_deserialization=True
             )
-            vectorstores[conversation_id] = vectorstore
-            print(f"✅ Index FAISS chargé pour conversation {conversation_id} ! ({vectorstore.index.ntotal} documents)")
-            return vectorstore
-        except Exception as e:
-            print(f"⚠️ Erreur de chargement de l'index pour {conversation_id} : {e}. L'index sera recréé.")
-            return None
-    else:
-        print(f"ℹ️ Aucun index FAISS trouvé pour conversation {conversation_id}. Il sera créé lors de la première ingestion.")
-        return None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur de chargement de l'index FAISS : {e}")
+    return vectorstore, build_source_map(vectorstore)
+
+@contextmanager
+def conversation_writer(conversation_id: str):
+    """
+    Verrou d'écriture exclusif sur l'index d'une conversation, partagé entre threads et entre workers.
+    Un nouvel objet FileLock par appel : deux threads du même worker s'excluent aussi mutuellement.
+    """
+    lock = FileLock(os.path.join(get_vector_store_path(conversation_id), WRITE_LOCK_FILE), timeout=WRITE_LOCK_TIMEOUT)
+    try:
+        with stage_timer("write_lock_wait"):
+            lock.acquire()
+    except Timeout:
+        raise HTTPException(status_code=503, detail=f"Une autre ingestion est en cours pour la conversation {conversation_id}.")
+    try:
+        yield
+    finally:
+        lock.release()
+
+def build_source_map(vectorstore: FAISS) -> Dict[str, Dict]:
+    """Regroupe les IDs des vecteurs par document source (ordre de l'index FAISS)."""
+    source_map: Dict[str, Dict] = {}
+    for position in sorted(vectorstore.index_to_docstore_id):
+        doc_id = vectorstore.index_to_docstore_id[position]
+        metadata = vectorstore.docstore.search(doc_id).metadata
+        # Les anciens index n'ont pas de content_hash : None (toujours considéré comme modifié)
+        entry = source_map.setdefault(metadata["source"], {
+            "content_hash": metadata.get("content_hash"),
+            "patient_id": metadata.get("patient_id"),
+            "ids": [],
+        })
+        entry["ids"].append(doc_id)
+    return source_map
+
+def find_indexed_source(source_map: Dict[str, Dict], source: str, content_hash: str) -> Optional[str]:
+    """Source sous laquelle ce contenu est déjà indexé (même nom en priorité, sinon même empreinte), ou None."""
+    entry = source_map.get(source)
+    if entry is not None and entry["content_hash"] == content_hash:
+        return source
+    for other_source, other in source_map.items():
+        if other["content_hash"] == content_hash:
+            return other_source
+    return None
+
+def stale_legacy_ids(vectorstore: FAISS) -> List[str]:
+    """
+    IDs des anciennes copies des documents indexés avant l'upsert (sans content_hash).
+    Chaque upload ajoutait une série de fragments contiguë ; une nouvelle série commence après un trou
+    dans les positions, quand le pseudonyme Patient_N change (le deid-service en attribuait un nouveau
+    à chaque upload), ou quand le premier fragment du document réapparaît (au pseudonyme près).
+    Seule la dernière série de chaque source est conservée.
+    """
+    runs: Dict[str, List[List[str]]] = {}
+    first_chunk: Dict[str, str] = {}
+    last_position: Dict[str, int] = {}
+    run_label: Dict[str, Optional[str]] = {}
+    for position in sorted(vectorstore.index_to_docstore_id):
+        doc_id = vectorstore.index_to_docstore_id[position]
+        doc = vectorstore.docstore.search(doc_id)
+        if doc.metadata.get("content_hash") is not None:
+            continue
+        source = doc.metadata["source"]
+        normalized = PATIENT_LABEL.sub("Patient_#", doc.page_content)
+        # Un fragment peut ne contenir aucun pseudonyme : il reste alors dans la série en cours
+        labels = PATIENT_LABEL.findall(doc.page_content)
+        label = labels[0] if labels else None
+
+        if source not in runs:
+            runs[source] = [[doc_id]]
+            first_chunk[source] = normalized
+            run_label[source] = label
+        elif (position != last_position[source] + 1
+              or normalized == first_chunk[source]
+              or (label is not None and run_label[source] is not None and label != run_label[source])):
+            runs[source].append([doc_id])
+            run_label[source] = label
+        else:
+            runs[source][-1].append(doc_id)
+            if run_label[source] is None:
+                run_label[source] = label
+        last_position[source] = position
+
+    return [doc_id for source_runs in runs.values() for run in source_runs[:-1] for doc_id in run]
+
+def save_vector_store(conversation_id: str, vectorstore: FAISS, source_map: Dict[str, Dict]):
+    """
+    Sauvegarde la copie modifiée (voir load_for_write) sous une nouvelle version, la publie dans VERSION,
+    puis la substitue à l'index en mémoire. À appeler sous conversation_writer.
+    En cas d'échec, l'index en mémoire (dernière version publiée) reste inchangé.
+    """
+    conv_folder = get_vector_store_path(conversation_id)
+    version = read_index_version(conversation_id) + 1
+    try:
+        with stage_timer("save_local"):
+            vectorstore.save_local(conv_folder, index_name(version))
+
+        tmp_path = os.path.join(conv_folder, VERSION_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(version))
+        retry_on_permission_error(lambda: os.replace(tmp_path, os.path.join(conv_folder, VERSION_FILE)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la sauvegarde FAISS : {e}")
+
+    # Les recherches déjà lancées terminent sur l'ancien objet, les suivantes utilisent le nouveau
+    vectorstores[conversation_id] = vectorstore
+    source_maps[conversation_id] = source_map
+    loaded_versions[conversation_id] = version
+
+    remove_old_versions(conv_folder, version)
+
+def remove_old_versions(conv_folder: str, version: int):
+    """Supprime les fichiers des anciennes versions, en gardant la précédente pour les workers en cours de lecture."""
+    for filename in os.listdir(conv_folder):
+        match = VERSIONED_INDEX.match(filename)
+        old_version = int(match.group(1)) if match else (0 if filename in ("faiss.index.faiss", "faiss.index.pkl") else None)
+        if old_version is not None and old_version < version - 1:
+            try:
+                os.remove(os.path.join(conv_folder, filename))
+            except OSError as e:
+                print(f"⚠️ Impossible de supprimer l'ancienne version {filename} : {e}")
+
+def load_existing_for_write(conversation_id: str) -> Tuple[FAISS, Dict[str, Dict]]:
+    """Comme load_for_write, mais 404 si la conversation n'a pas encore d'index."""
+    if not conversation_id:
+        raise HTTPException(status_code=400, detail="conversation_id est requis.")
+    vectorstore, source_map = load_for_write(conversation_id)
+    if vectorstore is None:
+        raise HTTPException(status_code=404, detail=f"Aucun index pour la conversation {conversation_id}.")
+    return vectorstore, source_map
+
+def already_indexed_response(conversation_id: str, existing_source: str, entry: Dict) -> dict:
+    """Réponse d'ingestion quand le contenu est déjà indexé : rien n'est recalculé."""
+    return {
+        "status": "success",
+        "message": f"Inchangé : {existing_source} déjà indexé pour conversation {conversation_id}",
+        "already_indexed": True,
+        "patient_id": entry["patient_id"],
+    }
 
 # --- Schémas de données Pydantic ---
 
@@ -69,6 +351,24 @@ class IngestRequest(BaseModel):
     content: str = Field(..., description="Le texte brut du document à indexer.")
     source: str = Field(..., description="Le nom du fichier source (ex: 'doc.pdf').")
     conversation_id: str = Field(..., description="L'ID de la conversation.")
+    content_hash: Optional[str] = Field(None, description="Empreinte du document d'origine (sinon, SHA-256 du contenu).")
+    patient_id: Optional[str] = Field(None, description="Pseudonyme attribué par le deid-service (ex: 'Patient_1').")
+
+class DocumentStatusRequest(BaseModel):
+    """Schéma pour vérifier si un document est déjà indexé (avant anonymisation)."""
+    conversation_id: str = Field(..., description="L'ID de la conversation.")
+    source: str = Field(..., description="Le nom du fichier source.")
+    content_hash: str = Field(..., description="L'empreinte du document d'origine.")
+
+class DeleteRequest(BaseModel):
+    """Schéma pour la suppression d'un document d'une conversation."""
+    conversation_id: str = Field(..., description="L'ID de la conversation.")
+    source: Optional[str] = Field(None, description="Le nom du fichier source à supprimer.")
+    content_hash: Optional[str] = Field(None, description="Ou l'empreinte du document à supprimer.")
+
+class CompactRequest(BaseModel):
+    """Schéma pour le compactage de l'index d'une conversation."""
+    conversation_id: str = Field(..., description="L'ID de la conversation.")
 
 class Chunk(BaseModel):
     """Représentation d'un fragment de document pour la réponse de recherche."""
@@ -84,6 +384,8 @@ class RetrievalResponse(BaseModel):
 
 app = FastAPI(title="Semantic Indexer Microservice")
 
+install_tracing(app, service_metrics)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialisation au démarrage."""
@@ -91,6 +393,10 @@ async def startup_event():
 
 # --- Endpoints ---
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return service_metrics.render()
+
 @app.post("/index-chunks", status_code=200)
 def index_document(request: IngestRequest):
     text = request.content
@@ -103,33 +409,130 @@ def index_document(request: IngestRequest):
     if not conversation_id:
         raise HTTPException(status_code=400, detail="conversation_id est requis.")
 
+    content_hash = request.content_hash or hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    # 0. Si ce contenu est déjà indexé (sous ce nom ou un autre), rien à faire
+    load_vector_store(conversation_id)
+    source_map = source_maps.get(conversation_id, {})
+    existing_source = find_indexed_source(source_map, source, content_hash)
+
+    if existing_source is not None:
+        return already_indexed_response(conversation_id, existing_source, source_map[existing_source])
+
     # 1. Découpage (Chunking)
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=2000,   
         chunk_overlap=200,  
         separators=["\n\n", "\n", ".", " ", ""] 
     )
-    chunks = splitter.split_text(text)
-    docs = [Document(page_content=c, metadata={"source": source}) for c in chunks]
+    with stage_timer("split_text"):
+        chunks = splitter.split_text(text)
+    metadatas = [{"source": source, "content_hash": content_hash, "patient_id": request.patient_id} for _ in chunks]
+    ids = [str(uuid.uuid4()) for _ in chunks]
 
-    # 2. Charger ou créer l'index pour cette conversation
-    vectorstore = load_vector_store(conversation_id)
-    
-    if vectorstore is None:
-        # Créer un nouvel index pour cette conversation
-        vectorstore = FAISS.from_documents(docs, embeddings)
-        vectorstores[conversation_id] = vectorstore
-    else:
-        # Ajouter les documents à l'index existant
-        vectorstore.add_documents(docs)
+    # 2. Calcul des embeddings (séparé de l'ajout FAISS pour le mesurer)
+    with stage_timer("embedding"):
+        vectors = embeddings.embed_documents(chunks)
+    text_embeddings = list(zip(chunks, vectors))
 
-    # 3. Sauvegarde sur le disque
-    try:
-        conv_folder = get_vector_store_path(conversation_id)
-        vectorstore.save_local(conv_folder, "faiss.index")
-        return {"status": "success", "message": f"Indexé : {source} ({len(docs)} morceaux) pour conversation {conversation_id}"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la sauvegarde FAISS : {e}")
+    # 3. Écriture (un seul writer par conversation, tous workers confondus) : les embeddings sont
+    # calculés hors verrou, la dernière version publiée est relue sous verrou et modifiée sur une copie
+    with conversation_writer(conversation_id):
+        vectorstore, source_map = load_for_write(conversation_id)
+        existing_source = find_indexed_source(source_map, source, content_hash)
+        if existing_source is not None:
+            return already_indexed_response(conversation_id, existing_source, source_map[existing_source])
+        previous = source_map.get(source)
+
+        # Remplacer l'ancienne version du document (upsert par source) ou créer l'index
+        if previous is not None:
+            with stage_timer("faiss_delete"):
+                vectorstore.delete(previous["ids"])
+
+        with stage_timer("faiss_add"):
+            if vectorstore is None:
+                # Créer un nouvel index pour cette conversation
+                vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                # Ajouter les documents à l'index existant
+                vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        source_map[source] = {"content_hash": content_hash, "patient_id": request.patient_id, "ids": ids}
+
+        # 4. Sauvegarde sur le disque (nouvelle version publiée)
+        save_vector_store(conversation_id, vectorstore, source_map)
+
+    action = "Remplacé" if previous is not None else "Indexé"
+    return {
+        "status": "success",
+        "message": f"{action} : {source} ({len(chunks)} morceaux) pour conversation {conversation_id}",
+        "already_indexed": False,
+        "patient_id": request.patient_id,
+    }
+
+
+@app.post("/document-status", status_code=200)
+def document_status(request: DocumentStatusRequest):
+    """Indique si ce contenu est déjà indexé dans la conversation (sous ce nom ou un autre)."""
+    load_vector_store(request.conversation_id)
+    source_map = source_maps.get(request.conversation_id, {})
+    existing_source = find_indexed_source(source_map, request.source, request.content_hash)
+    if existing_source is None:
+        return {"already_indexed": False, "source": None, "patient_id": None}
+    return {"already_indexed": True, "source": existing_source, "patient_id": source_map[existing_source]["patient_id"]}
+
+
+@app.post("/delete-document", status_code=200)
+def delete_document(request: DeleteRequest):
+    """Supprime tous les vecteurs d'un document (par source ou par empreinte) de l'index d'une conversation."""
+    if not request.source and not request.content_hash:
+        raise HTTPException(status_code=400, detail="source ou content_hash est requis.")
+
+    with conversation_writer(request.conversation_id):
+        vectorstore, source_map = load_existing_for_write(request.conversation_id)
+
+        sources = [
+            source for source, entry in source_map.items()
+            if source == request.source or (request.content_hash and entry["content_hash"] == request.content_hash)
+        ]
+        if not sources:
+            raise HTTPException(status_code=404, detail="Document introuvable dans cette conversation.")
+
+        ids = [doc_id for source in sources for doc_id in source_map[source]["ids"]]
+        with stage_timer("faiss_delete"):
+            vectorstore.delete(ids)
+        for source in sources:
+            del source_map[source]
+
+        save_vector_store(request.conversation_id, vectorstore, source_map)
+        return {"status": "success", "message": f"Supprimé : {', '.join(sources)} ({len(ids)} morceaux) pour conversation {request.conversation_id}"}
+
+
+@app.post("/compact-index", status_code=200)
+def compact_index(request: CompactRequest):
+    """
+    Nettoie l'index d'une conversation : ne garde que la dernière copie de chaque document indexé
+    avant l'upsert (ré-uploads en mode ajout) et reconstruit le docstore avec les seuls fragments
+    encore référencés par FAISS.
+    """
+    with conversation_writer(request.conversation_id):
+        vectorstore, _ = load_existing_for_write(request.conversation_id)
+
+        with stage_timer("faiss_compact"):
+            stale_ids = stale_legacy_ids(vectorstore)
+            if stale_ids:
+                vectorstore.delete(stale_ids)
+            vectorstore.docstore = InMemoryDocstore({
+                doc_id: vectorstore.docstore.search(doc_id)
+                for doc_id in vectorstore.index_to_docstore_id.values()
+            })
+
+        save_vector_store(request.conversation_id, vectorstore, build_source_map(vectorstore))
+        return {
+            "status": "success",
+            "message": f"Index compacté pour conversation {request.conversation_id}",
+            "removed_chunks": len(stale_ids),
+            "remaining_chunks": vectorstore.index.ntotal,
+        }
 
 
 @app.post("/retrieve-chunks", response_model=RetrievalResponse)
@@ -146,10 +549,14 @@ def retrieve_chunks(request: RetrievalRequest):
         # Si pas d'index pour cette conversation, renvoie liste vide
         return RetrievalResponse(chunks=[])
     
-    docs_scores = vectorstore.similarity_search_with_score(
-        request.question,
-        k=request.k
-    )
+    with stage_timer("embed_query"):
+        query_vector = embeddings.embed_query(request.question)
+
+    with stage_timer("similarity_search_with_score"):
+        docs_scores = vectorstore.similarity_search_with_score_by_vector(
+            query_vector,
+            k=request.k
+        )
     
     # Filtrage
     relevant = [
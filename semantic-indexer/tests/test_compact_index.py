@@ -0,0 +1,106 @@
+"""
+Tests de /compact-index sur des index créés avant l'upsert (fragments sans content_hash).
+
+Lancement : cd semantic-indexer && python -m pytest tests
+"""
+import os
+import sys
+import types
+import hashlib
+import importlib.util
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+class FakeEmbeddings(Embeddings):
+    """Embeddings déterministes (pas de téléchargement de modèle pendant les tests)."""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255 for b in digest[:16]]
+
+    def embed_documents(self, texts):
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture
+def indexer(tmp_path, monkeypatch):
+    """Charge semantic-indexer/main.py avec des embeddings factices et un VECTOR_FOLDER temporaire."""
+    monkeypatch.setenv("VECTOR_FOLDER", str(tmp_path))
+    monkeypatch.setitem(sys.modules, "langchain_huggingface", types.SimpleNamespace(HuggingFaceEmbeddings=FakeEmbeddings))
+    spec = importlib.util.spec_from_file_location("semantic_indexer_main_test", MAIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_legacy_index(folder, conversation_id, chunks):
+    """Index historique (faiss.index, sans VERSION) : métadonnées {"source"} uniquement, uploads ajoutés à la suite."""
+    texts = [text for _, text in chunks]
+    metadatas = [{"source": source} for source, _ in chunks]
+    FAISS.from_texts(texts, FakeEmbeddings(), metadatas=metadatas).save_local(os.path.join(folder, conversation_id), "faiss.index")
+
+
+def remaining_texts(indexer, conversation_id):
+    vectorstore = indexer.vectorstores[conversation_id]
+    return [vectorstore.docstore.search(doc_id).page_content for doc_id in vectorstore.index_to_docstore_id.values()]
+
+
+def compact(indexer, conversation_id):
+    response = TestClient(indexer.app).post("/compact-index", json={"conversation_id": conversation_id})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_corrected_report_reuploaded_right_after_original(indexer, tmp_path):
+    # Compte rendu court (1 fragment), corrigé puis ré-uploadé juste après : pas de trou, premier fragment différent
+    write_legacy_index(str(tmp_path), "c1", [
+        ("r.pdf", "Compte rendu de Patient_1 : tension normale."),
+        ("r.pdf", "Compte rendu de Patient_2 : tension élevée, traitement ajusté."),
+    ])
+
+    result = compact(indexer, "c1")
+
+    assert result["removed_chunks"] == 1
+    assert result["remaining_chunks"] == 1
+    assert remaining_texts(indexer, "c1") == ["Compte rendu de Patient_2 : tension élevée, traitement ajusté."]
+
+
+def test_identical_reuploads_keep_latest_copy(indexer, tmp_path):
+    document = [f"Compte rendu {{label}} section {i}" for i in range(5)]
+    write_legacy_index(str(tmp_path), "c1",
+        [("a.pdf", text.format(label="Patient_1")) for text in document]
+        + [("a.pdf", text.format(label="Patient_2")) for text in document]
+    )
+
+    result = compact(indexer, "c1")
+
+    assert result["removed_chunks"] == 5
+    assert remaining_texts(indexer, "c1") == [text.format(label="Patient_2") for text in document]
+
+
+def test_chunks_without_label_stay_in_their_upload(indexer, tmp_path):
+    # Seul le premier fragment porte le pseudonyme ; un autre document sépare les deux uploads
+    write_legacy_index(str(tmp_path), "c1", [
+        ("a.pdf", "Patient_1 : antécédents"),
+        ("a.pdf", "examens sans nom"),
+        ("b.pdf", "autre document"),
+        ("a.pdf", "Patient_3 : antécédents mis à jour"),
+        ("a.pdf", "examens sans nom"),
+    ])
+
+    result = compact(indexer, "c1")
+
+    assert result["removed_chunks"] == 2
+    assert remaining_texts(indexer, "c1") == ["autre document", "Patient_3 : antécédents mis à jour", "examens sans nom"]